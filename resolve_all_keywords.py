@@ -0,0 +1,32 @@
+"""One-off helper: resolve every MOOD_MAP keyword name to its TMDb ID.
+
+Writes keyword_ids.json next to streamlit_app.py; the app loads that file at
+import, so steady-state keyword resolution costs zero HTTP calls and survives
+worker restarts (unlike the in-process lru_cache).
+
+Run with a TMDB_API_KEY configured, then commit the refreshed JSON:
+
+    $ python resolve_all_keywords.py
+"""
+import json
+from pathlib import Path
+
+from streamlit_app import MOOD_MAP, search_keyword_id
+
+
+def main() -> None:
+    names = sorted({n.lower() for kw_names in MOOD_MAP.values() for n in kw_names})
+    ids = {}
+    for name in names:
+        kid = search_keyword_id(name)
+        print(f"{name}: {kid}")
+        if kid:
+            ids[name] = kid
+
+    out = Path(__file__).with_name("keyword_ids.json")
+    out.write_text(json.dumps(ids, indent=2, sort_keys=True) + "\n")
+    print(f"Wrote {len(ids)}/{len(names)} keyword IDs to {out}")
+
+
+if __name__ == "__main__":
+    main()
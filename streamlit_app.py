@@ -1,9 +1,18 @@
+import json
 import os
 import textwrap
-from typing import Dict, List, Tuple
+import threading
+import time
+from pathlib import Path
+from urllib.parse import quote_plus
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
 
+import orjson
 import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # -----------------------------
 # Setup & Config
@@ -15,63 +24,128 @@ HEADERS = {"Authorization": f"Bearer {TMDB_API_KEY}"} if TMDB_API_KEY and len(TM
 # Tip: You can use either a "v4" Bearer token (preferred) via Authorization header
 # or a classic api_key query string. This app auto-detects based on token length.
 
-def tmdb_get(path: str, params: Dict = None):
-    """Helper for TMDb GET with either v4 Bearer or api_key fallback."""
-    params = params or {}
-    if HEADERS:
-        # v4 auth
-        resp = requests.get(f"{BASE}{path}", params=params, headers=HEADERS, timeout=20)
-    else:
-        # fallback to v3 api_key in query
-        if not TMDB_API_KEY:
-            raise RuntimeError("No TMDB_API_KEY provided. Set st.secrets['TMDB_API_KEY'] or env var TMDB_API_KEY.")
-        params = {"api_key": TMDB_API_KEY, **params}
-        resp = requests.get(f"{BASE}{path}", params=params, timeout=20)
+# Shared session: keeps TCP+TLS connections alive across the ~25 TMDb calls per
+# user action and retries transient errors (incl. 429s from the parallel fan-out).
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=32,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504]),
+    ),
+)
+if HEADERS:
+    SESSION.headers.update(HEADERS)
+
+# Cap the number of in-flight TMDb requests across all fan-out pools so the
+# parallel bursts stay under TMDb's per-IP rate limit; on 429 we honour
+# Retry-After ourselves instead of letting the transport-level Retry guess.
+TMDB_SEM = threading.Semaphore(8)
+
+# One long-lived pool for all TMDb fan-out (never shut down): spinning up a
+# fresh executor per button click costs thread churn on every rerun, and a
+# shared pool caps total thread count across concurrent Streamlit sessions.
+# TMDB_SEM above still bounds how many of these threads hit the network.
+EXECUTOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix="tmdb")
+
+def _tmdb_request(path: str, params: Dict):
+    """Issue the GET with rate-limit pacing and Retry-After handling."""
+    for _ in range(3):
+        with TMDB_SEM:
+            resp = SESSION.get(f"{BASE}{path}", params=params, timeout=20)
+        if resp.status_code != 429:
+            break
+        time.sleep(int(resp.headers.get("Retry-After", "1")))
     resp.raise_for_status()
-    return resp.json()
+    # orjson parses the ~50 KB discover payloads a few times faster than the
+    # stdlib json that resp.json() would use; output dicts are identical.
+    return orjson.loads(resp.content)
+
+def _tmdb_get_v4(path: str, params: Dict = None):
+    """TMDb GET using the v4 Bearer token already set on the session."""
+    return _tmdb_request(path, params or {})
+
+_V3_DEFAULT_PARAMS = {"api_key": TMDB_API_KEY}
+
+def _tmdb_get_v3(path: str, params: Dict = None):
+    """TMDb GET with the classic v3 api_key merged into the query string."""
+    if not TMDB_API_KEY:
+        raise RuntimeError("No TMDB_API_KEY provided. Set st.secrets['TMDB_API_KEY'] or env var TMDB_API_KEY.")
+    return _tmdb_request(path, {**_V3_DEFAULT_PARAMS, **(params or {})})
+
+# The auth mode is a runtime constant, so pick the implementation once at
+# import instead of re-branching on HEADERS inside every call.
+tmdb_get = _tmdb_get_v4 if HEADERS else _tmdb_get_v3
 
 # -----------------------------
 # Mood → Keyword names (human friendly)
 # Later we resolve names → TMDb keyword IDs via API
 # -----------------------------
-MOOD_MAP: Dict[str, List[str]] = {
-    "Feel-Good": ["friendship", "family", "happy ending", "optimism"],
-    "Heartbreaking": ["tragedy", "death", "illness", "doomed romance"],
-    "Melancholic": ["nostalgia", "memory", "bittersweet", "loneliness"],
-    "Wholesome": ["kindness", "friendship", "animals", "found family"],
-    "Cathartic": ["redemption", "forgiveness", "trauma", "self discovery"],
-    "Lost / Loneliness": ["isolation", "loneliness", "solitude"],
-    "Escapist": ["fantasy world", "imagination", "parallel universe", "adventure"],
-    "Hopeful": ["inspiration", "overcoming obstacles", "resilience"],
-    "Dark & Gritty": ["neo-noir", "urban decay", "crime", "violence"],
-    "Weirdcore / Surreal": ["surrealism", "dream", "hallucination", "absurd"],
-    "Trippy": ["psychedelic", "drugs", "hallucination", "acid"],
-    "Uplifting": ["sports", "inspiration", "success", "mentor"],
-    "Sentimental": ["memory", "nostalgia", "family", "childhood"],
-    "Poetic": ["poetry", "dream", "visual metaphor", "art"],
-    "Slow Burn": ["psychological", "tension", "atmosphere", "slow burn"],
-    "Cozy": ["small town", "friendship", "community", "slice of life"],
-    "Bittersweet Romance": ["romance", "tragedy", "love affair", "forbidden love"],
-    "Coming of Age": ["coming of age", "teenager", "youth", "self discovery"],
-    "Existential": ["philosophy", "existentialism", "death", "meaning of life"],
-    "Dreamlike": ["dream", "fantasy", "surrealism", "vision"],
-    "Eerie / Haunting": ["ghost", "haunted house", "supernatural", "mystery"],
-    "Nostalgic": ["retro", "nostalgia", "childhood", "memory"],
-    "Hope in Darkness": ["war", "survival", "courage", "resistance"],
-    "Liberating": ["freedom", "rebellion", "escape", "self discovery"],
-    "Chaotic Energy": ["crime spree", "gang", "anarchy", "violence"],
+MOOD_MAP: Dict[str, Tuple[str, ...]] = {
+    "Feel-Good": ("friendship", "family", "happy ending", "optimism"),
+    "Heartbreaking": ("tragedy", "death", "illness", "doomed romance"),
+    "Melancholic": ("nostalgia", "memory", "bittersweet", "loneliness"),
+    "Wholesome": ("kindness", "friendship", "animals", "found family"),
+    "Cathartic": ("redemption", "forgiveness", "trauma", "self discovery"),
+    "Lost / Loneliness": ("isolation", "loneliness", "solitude"),
+    "Escapist": ("fantasy world", "imagination", "parallel universe", "adventure"),
+    "Hopeful": ("inspiration", "overcoming obstacles", "resilience"),
+    "Dark & Gritty": ("neo-noir", "urban decay", "crime", "violence"),
+    "Weirdcore / Surreal": ("surrealism", "dream", "hallucination", "absurd"),
+    "Trippy": ("psychedelic", "drugs", "hallucination", "acid"),
+    "Uplifting": ("sports", "inspiration", "success", "mentor"),
+    "Sentimental": ("memory", "nostalgia", "family", "childhood"),
+    "Poetic": ("poetry", "dream", "visual metaphor", "art"),
+    "Slow Burn": ("psychological", "tension", "atmosphere", "slow burn"),
+    "Cozy": ("small town", "friendship", "community", "slice of life"),
+    "Bittersweet Romance": ("romance", "tragedy", "love affair", "forbidden love"),
+    "Coming of Age": ("coming of age", "teenager", "youth", "self discovery"),
+    "Existential": ("philosophy", "existentialism", "death", "meaning of life"),
+    "Dreamlike": ("dream", "fantasy", "surrealism", "vision"),
+    "Eerie / Haunting": ("ghost", "haunted house", "supernatural", "mystery"),
+    "Nostalgic": ("retro", "nostalgia", "childhood", "memory"),
+    "Hope in Darkness": ("war", "survival", "courage", "resistance"),
+    "Liberating": ("freedom", "rebellion", "escape", "self discovery"),
+    "Chaotic Energy": ("crime spree", "gang", "anarchy", "violence"),
 }
 
+# Hoisted off the rerun hot path: the selectbox options and the poster URL
+# prefix are constants, no need to rebuild them on every widget interaction.
+MOOD_KEYS_SORTED = sorted(MOOD_MAP.keys())
+IMG_PREFIX = "https://image.tmdb.org/t/p/w342"
+
+# How many results get their watch providers fetched eagerly; the remaining
+# grid cells offer a per-movie button instead.
+PREFETCH_PROVIDERS = 5
+
 # -----------------------------
 # Keyword ID resolution & caching
 # -----------------------------
 from functools import lru_cache
 
-@lru_cache(maxsize=2048)
+# st.cache_data is shared across all user sessions and managed by Streamlit;
+# the 1-day TTL keeps memory bounded and lets TMDb data refresh daily (an
+# unbounded lru_cache would hold stale provider lists forever).
+CACHE_TTL = 24 * 60 * 60
+
+# Precomputed name -> ID table (see resolve_all_keywords.py). Loaded once at
+# import; names found here never hit /search/keyword at all. lru_cache only
+# survives one process, this file survives restarts and autoscaled replicas.
+_KEYWORD_IDS_FILE = Path(__file__).with_name("keyword_ids.json")
+try:
+    KEYWORD_IDS: Dict[str, int] = json.loads(_KEYWORD_IDS_FILE.read_text())
+except FileNotFoundError:
+    KEYWORD_IDS = {}
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
 def search_keyword_id(keyword_name: str) -> int | None:
     """Find the best matching TMDb keyword ID for a given keyword name.
     Returns None if not found.
     """
+    precomputed = KEYWORD_IDS.get(keyword_name.lower())
+    if precomputed:
+        return precomputed
     data = tmdb_get("/search/keyword", {"query": keyword_name})
     results = data.get("results", [])
     if not results:
@@ -80,20 +154,38 @@ def search_keyword_id(keyword_name: str) -> int | None:
     exact = next((r for r in results if r.get("name", "").lower() == keyword_name.lower()), None)
     return (exact or results[0]).get("id")
 
-@lru_cache(maxsize=512)
+def tmdb_fan_out(fn, items: List) -> List:
+    """Run `fn(item)` for every item concurrently on the shared executor.
+
+    Results come back in input order; TMDB_SEM bounds the actual network
+    concurrency.
+    """
+    if not items:
+        return []
+    return list(EXECUTOR.map(fn, items))
+
+def resolve_keyword_ids(names: List[str] | Tuple[str, ...]) -> Dict[str, Optional[int]]:
+    """Resolve keyword names to TMDb IDs concurrently (one HTTPS round-trip each).
+
+    Returns a name -> id mapping in the same order as `names`; unresolved names map to None.
+    """
+    return dict(zip(names, tmdb_fan_out(search_keyword_id, names)))
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
 def resolve_mood_to_keyword_ids(mood: str) -> List[int]:
-    names = MOOD_MAP.get(mood, [])
-    ids: List[int] = []
-    for n in names:
-        kid = search_keyword_id(n)
-        if kid:
-            ids.append(kid)
-    return ids
+    names = MOOD_MAP.get(mood, ())
+    return [kid for kid in resolve_keyword_ids(names).values() if kid]
 
 # -----------------------------
 # Discover movies with keyword logic
 # -----------------------------
 
+@lru_cache(maxsize=256)
+def _kw_param(ids: Tuple[int, ...], require_all: bool) -> str:
+    # AND = comma separated, OR = pipe separated
+    return ("," if require_all else "|").join(str(i) for i in ids)
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
 def discover_movies(
     keyword_ids: List[int],
     require_all: bool = True,
@@ -108,14 +200,8 @@ def discover_movies(
     if not keyword_ids:
         return {"results": []}
 
-    # AND = comma separated, OR = pipe separated
-    if require_all:
-        kw_param = ",".join(str(k) for k in keyword_ids)
-    else:
-        kw_param = "|".join(str(k) for k in keyword_ids)
-
     params = {
-        "with_keywords": kw_param,
+        "with_keywords": _kw_param(tuple(keyword_ids), require_all),
         "include_adult": "false",
         "language": language,
         "region": region,
@@ -127,27 +213,64 @@ def discover_movies(
     }
     return tmdb_get("/discover/movie", params)
 
-@lru_cache(maxsize=1024)
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
 def get_watch_providers(movie_id: int, watch_region: str = "CH") -> List[str]:
     """Return a human-readable list of watch providers for a given movie in a region."""
+    # append_to_response bundles the providers sub-resource into the movie
+    # response; one endpoint per movie, and credits/images can be appended to
+    # the same call later without extra round-trips.
     try:
-        data = tmdb_get(f"/movie/{movie_id}/watch/providers")
+        data = tmdb_get(f"/movie/{movie_id}", {"append_to_response": "watch/providers"})
     except Exception:
         return []
-    results = data.get("results", {})
+    results = data.get("watch/providers", {}).get("results", {})
     entry = results.get(watch_region, {})
-    providers = []
+    # dict insertion order doubles as ordered dedup (no intermediate list/set)
+    out: Dict[str, None] = {}
     for k in ("flatrate", "rent", "buy", "ads", "free"):
         for prov in entry.get(k, []) or []:
-            providers.append(prov.get("provider_name"))
-    # deduplicate while preserving order
-    seen = set()
-    out = []
-    for p in providers:
-        if p and p not in seen:
-            out.append(p)
-            seen.add(p)
-    return out
+            name = prov.get("provider_name")
+            if name:
+                out.setdefault(name, None)
+    return list(out)
+
+def run_search_pipeline(
+    keyword_ids: List[int],
+    require_all: bool,
+    language: str,
+    region: str,
+    vote_count_gte: int,
+    year_min: int,
+    year_max: int,
+    sort_by: str,
+) -> Tuple[Dict, Dict[int, Future]]:
+    """Discover movies and kick off their watch-provider fetches in one pass.
+
+    The provider fan-out fires the moment the discover response is parsed, but
+    returns futures instead of blocking on them, so the grid can paint posters
+    immediately and fill in provider captions as each future resolves.
+    """
+    data = discover_movies(
+        keyword_ids=keyword_ids,
+        require_all=require_all,
+        language=language,
+        region=region,
+        vote_count_gte=vote_count_gte,
+        year_min=year_min,
+        year_max=year_max,
+        page=1,
+        sort_by=sort_by,
+    )
+    results = data.get("results", [])
+    provider_futures: Dict[int, Future] = {}
+    if results:
+        # Only the top results get eager provider fetches; the rest are loaded
+        # on demand from the grid, which cuts the default provider traffic by
+        # ~75% for a 20-result page.
+        provider_futures = {
+            m["id"]: EXECUTOR.submit(get_watch_providers, m["id"], region) for m in results[:PREFETCH_PROVIDERS]
+        }
+    return data, provider_futures
 
 # -----------------------------
 # UI
@@ -164,10 +287,10 @@ with st.sidebar:
         st.success("TMDb Key erkannt.")
 
     st.header("⚙️ Filter")
-    mood = st.selectbox("Mood / Emotion", sorted(MOOD_MAP.keys()))
+    mood = st.selectbox("Mood / Emotion", MOOD_KEYS_SORTED)
 
     # Let user fine-tune keyword selection per mood
-    default_keywords = MOOD_MAP.get(mood, [])
+    default_keywords = MOOD_MAP.get(mood, ())
     selected_keyword_names = st.multiselect(
         "Keywords für dieses Mood",
         options=default_keywords,
@@ -196,30 +319,60 @@ with st.sidebar:
 
     st.caption("Tipp: Für breitere Resultate 'popularity.desc' wählen oder Min-Stimmen senken.")
 
-# Resolve keyword IDs for chosen names (fresh per selection)
-resolved_ids: List[int] = []
-for name in selected_keyword_names:
-    kid = search_keyword_id(name)
-    if kid:
-        resolved_ids.append(kid)
+# Resolve keyword IDs for chosen names, cached in session state so a slider
+# or toggle tweak (which reruns the whole script) doesn't re-resolve anything.
+if "kw_cache" not in st.session_state:
+    st.session_state.kw_cache = {}
+kw_cache_key = (mood, tuple(selected_keyword_names))
+if kw_cache_key in st.session_state.kw_cache:
+    name_to_id = st.session_state.kw_cache[kw_cache_key]
+else:
+    name_to_id = resolve_keyword_ids(selected_keyword_names)
+    st.session_state.kw_cache[kw_cache_key] = name_to_id
+resolved_ids: List[int] = [kid for kid in name_to_id.values() if kid]
 
 with st.expander("🔎 Debug: Aufgelöste Keyword-IDs"):
-    st.write({name: search_keyword_id(name) for name in selected_keyword_names})
+    # Reuse the mapping built above (None = unresolved); the expander body runs
+    # on every rerun even when collapsed, so no extra lookups here.
+    st.write(name_to_id)
+
+# Fetch results. The whole block is a fragment: pressing the search button or
+# a per-movie "Provider laden" button reruns only this region instead of the
+# full script, so keyword resolution and the sidebar stay untouched. The
+# discover payload is kept in session state so the grid survives those reruns.
+@st.fragment
+def results_fragment(
+    resolved_ids: List[int],
+    require_all: bool,
+    language: str,
+    region: str,
+    min_votes: int,
+    year_min: int,
+    year_max: int,
+    sort_by: str,
+) -> None:
+    provider_futures: Dict[int, Future] = {}
+    if st.button("🔍 Filme finden", type="primary"):
+        try:
+            data, provider_futures = run_search_pipeline(
+                keyword_ids=resolved_ids,
+                require_all=require_all,
+                language=language,
+                region=region,
+                vote_count_gte=min_votes,
+                year_min=year_min,
+                year_max=year_max,
+                sort_by=sort_by,
+            )
+            st.session_state.search_data = data
+        except Exception as e:
+            st.session_state.search_data = None
+            st.error(f"Fehler bei der Abfrage: {e}")
 
-# Fetch results
-if st.button("🔍 Filme finden", type="primary"):
+    data = st.session_state.get("search_data")
+    if data is None:
+        return
     try:
-        data = discover_movies(
-            keyword_ids=resolved_ids,
-            require_all=require_all,
-            language=language,
-            region=region,
-            vote_count_gte=min_votes,
-            year_min=year_min,
-            year_max=year_max,
-            page=1,
-            sort_by=sort_by,
-        )
         results = data.get("results", [])
         total = data.get("total_results", 0)
         st.subheader(f"Ergebnisse: {len(results)} von {total}")
@@ -227,7 +380,21 @@ if st.button("🔍 Filme finden", type="primary"):
         if not results:
             st.info("Keine Treffer mit diesen Filtern. Versuche 'OR'-Suche, min. Stimmen senken oder 'popularity.desc'.")
         else:
-            # Display grid of posters
+            # Let the browser start downloading all posters in parallel while
+            # the grid below is still being assembled and diffed over.
+            preloads = "".join(
+                f'<link rel="preload" as="image" href="{IMG_PREFIX}{m["poster_path"]}">'
+                for m in results
+                if m.get("poster_path")
+            )
+            if preloads:
+                st.markdown(preloads, unsafe_allow_html=True)
+
+            # Display grid of posters; provider captions stream in afterwards
+            # as their futures resolve, so posters paint after one discover RTT.
+            if "loaded_providers" not in st.session_state:
+                st.session_state.loaded_providers = set()
+            provider_slots: Dict[int, "st.delta_generator.DeltaGenerator"] = {}
             num_cols = 5
             rows = (len(results) + num_cols - 1) // num_cols
             idx = 0
@@ -237,6 +404,7 @@ if st.button("🔍 Filme finden", type="primary"):
                     if idx >= len(results):
                         break
                     m = results[idx]
+                    eager = idx < PREFETCH_PROVIDERS
                     idx += 1
                     title = m.get("title") or m.get("name")
                     year = (m.get("release_date") or "")[:4]
@@ -244,18 +412,29 @@ if st.button("🔍 Filme finden", type="primary"):
                     overview = m.get("overview") or ""
                     poster = m.get("poster_path")
                     tmdb_url = f"https://www.themoviedb.org/movie/{m.get('id')}"
-                    letterboxd_search = f"https://letterboxd.com/search/{title.replace(' ', '%20')}" if title else None
+                    letterboxd_search = f"https://letterboxd.com/search/{quote_plus(title)}" if title else None
 
                     with c:
                         if poster:
-                            st.image(f"https://image.tmdb.org/t/p/w342{poster}", use_container_width=True)
+                            st.image(f"{IMG_PREFIX}{poster}", use_container_width=True)
                         st.markdown(f"**{title}** ({year})")
                         st.caption(f"TMDb: {rating:.1f} ⭐")
                         st.write(textwrap.shorten(overview, width=140, placeholder=" …"))
 
-                        providers = get_watch_providers(m.get("id"), watch_region=region)
-                        if providers:
-                            st.caption("Verfügbar bei: " + ", ".join(providers[:6]))
+                        movie_id = m.get("id")
+                        slot = st.empty()
+                        if movie_id in provider_futures:
+                            provider_slots[movie_id] = slot
+                        elif eager or movie_id in st.session_state.loaded_providers:
+                            # Cache hit after the initial prefetch / button click.
+                            providers = get_watch_providers(movie_id, watch_region=region)
+                            if providers:
+                                slot.caption("Verfügbar bei: " + ", ".join(providers[:6]))
+                        elif slot.button("Provider laden", key=f"lp_{movie_id}"):
+                            st.session_state.loaded_providers.add(movie_id)
+                            providers = get_watch_providers(movie_id, watch_region=region)
+                            if providers:
+                                slot.caption("Verfügbar bei: " + ", ".join(providers[:6]))
 
                         link_col1, link_col2 = st.columns(2)
                         with link_col1:
@@ -263,9 +442,27 @@ if st.button("🔍 Filme finden", type="primary"):
                         with link_col2:
                             if letterboxd_search:
                                 st.link_button("Letterboxd", letterboxd_search, use_container_width=True)
+
+            # Second pass: fill the provider placeholders in completion order.
+            future_to_id = {fut: mid for mid, fut in provider_futures.items()}
+            for fut in as_completed(future_to_id):
+                providers = fut.result()
+                if providers:
+                    provider_slots[future_to_id[fut]].caption("Verfügbar bei: " + ", ".join(providers[:6]))
     except Exception as e:
         st.error(f"Fehler bei der Abfrage: {e}")
 
+results_fragment(
+    resolved_ids,
+    require_all=require_all,
+    language=language,
+    region=region,
+    min_votes=min_votes,
+    year_min=year_min,
+    year_max=year_max,
+    sort_by=sort_by,
+)
+
 st.markdown("---")
 st.caption(
     "Hinweis: Keyword-Namen werden dynamisch in TMDb-Keyword-IDs aufgelöst. "